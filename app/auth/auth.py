@@ -1,59 +1,96 @@
-import hashlib
+import hmac
 import secrets
-from datetime import datetime, timedelta
+import threading
+import time
+from datetime import timedelta
 from typing import Optional
-from fastapi import Request, HTTPException, Depends, status
-from fastapi.security import HTTPBearer
-from jose import jwt, JWTError
+from fastapi import Request, Response, HTTPException, status
+import jwt
+from jwt import InvalidTokenError
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from cachetools import TTLCache
 
 from app.config import settings
 
 
-def hash_sha256(password: str) -> str:
-    """Hash password using SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+# HS256 signing key, encoded once
+_SECRET = settings.secret_key.encode()
+
+# Argon2id with a per-hash random salt; the cost parameters are stored in the hash itself
+password_hasher = PasswordHasher(time_cost=3, memory_cost=64 * 1024, parallelism=4)
+
+
+def hash_password(password: str) -> str:
+    """Hash password using Argon2id"""
+    return password_hasher.hash(password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify password against SHA256 hash"""
-    return hash_sha256(plain_password) == hashed_password
+    """Verify password against Argon2id hash"""
+    try:
+        return password_hasher.verify(hashed_password, plain_password)
+    except (VerificationError, InvalidHashError):
+        return False
 
 
 def create_access_token(username: str, expires_delta: Optional[timedelta] = None) -> str:
     """Create JWT access token for session management"""
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(hours=24)  # 24 hour sessions
+    lifetime = int(expires_delta.total_seconds()) if expires_delta else 86400  # 24 hour sessions
     
     to_encode = {
         "sub": username,
-        "exp": expire,
+        "exp": int(time.time()) + lifetime,
         "type": "access"
     }
     
-    encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm="HS256")
+    encoded_jwt = jwt.encode(to_encode, _SECRET, algorithm="HS256")
     return encoded_jwt
 
 
+# Verified session tokens -> (username, exp); only successfully verified tokens are stored
+_token_cache = TTLCache(maxsize=4096, ttl=60)
+_token_cache_lock = threading.Lock()
+
+
 def verify_token(token: str) -> Optional[str]:
     """Verify JWT token and return username if valid"""
+    with _token_cache_lock:
+        cached = _token_cache.get(token)
+    if cached is not None:
+        username, expires_at = cached
+        if time.time() < expires_at:
+            return username
+        with _token_cache_lock:
+            _token_cache.pop(token, None)
+        return None
+
     try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=["HS256"])
-        username: str = payload.get("sub")
-        if username is None:
-            return None
-        return username
-    except JWTError:
+        payload = jwt.decode(
+            token,
+            _SECRET,
+            algorithms=["HS256"],
+            options={"require": ["exp", "sub"], "verify_aud": False}
+        )
+        username: str = payload["sub"]
+    except InvalidTokenError:
         return None
 
+    with _token_cache_lock:
+        _token_cache[token] = (username, payload["exp"])
+    return username
+
 
 def authenticate_user(username: str, password: str) -> bool:
     """Authenticate user against environment variables"""
-    if username != settings.username:
-        return False
-    
-    return verify_password(password, settings.password_hash)
+    # Compare both credentials so a wrong username costs the same as a wrong password
+    username_ok = hmac.compare_digest(username.encode(), settings.username.encode())
+    password_ok = verify_password(password, settings.password_hash)
+    return username_ok and password_ok
+
+
+CSRF_TOKEN_MIN_LENGTH = 32
+CSRF_COOKIE_NAME = "csrf_token"
 
 
 def generate_csrf_token() -> str:
@@ -61,15 +98,62 @@ def generate_csrf_token() -> str:
     return secrets.token_urlsafe(32)
 
 
-def verify_csrf_token(token: str, session_token: str) -> bool:
-    """Verify CSRF token - for simplicity, we'll use a basic implementation"""
-    # In a more robust implementation, we'd store CSRF tokens in session
-    # For now, we'll validate that the token exists and is properly formatted
-    return token and len(token) >= 32
+def verify_csrf_token(token: Optional[str], expected_token: Optional[str] = None) -> bool:
+    """Verify CSRF token format and, when an expected token is given, its value"""
+    if not isinstance(token, str) or len(token) < CSRF_TOKEN_MIN_LENGTH:
+        return False
+    if expected_token is None:
+        # No per-session token to compare against; only the format is checked
+        return True
+    return hmac.compare_digest(token.encode(), expected_token.encode())
+
+
+def get_csrf_token(request: Request) -> str:
+    """Return the browser's CSRF token from its cookie, issuing a new one if it has none"""
+    token = getattr(request.state, "csrf", None)
+    if token is None:
+        token = request.cookies.get(CSRF_COOKIE_NAME)
+        if not verify_csrf_token(token):
+            token = generate_csrf_token()
+            request.state.csrf_issued = True
+        request.state.csrf = token
+    return token
+
+
+def check_csrf_token(request: Request, token: Optional[str]) -> bool:
+    """Compare a submitted CSRF token with the browser's cookie-bound token in constant time"""
+    expected = request.cookies.get(CSRF_COOKIE_NAME)
+    if not expected:
+        return False
+    request.state.csrf = expected
+    return hmac.compare_digest((token or "").encode(), expected.encode())
+
+
+def set_csrf_cookie(response: Response, token: str) -> None:
+    """Store the CSRF token in a cookie so later pages reuse it"""
+    response.set_cookie(
+        key=CSRF_COOKIE_NAME,
+        value=token,
+        httponly=True,
+        secure=settings.cookie_secure,
+        samesite=settings.cookie_samesite
+    )
+
+
+def attach_csrf_cookie(request: Request, response: Response) -> Response:
+    """Set the CSRF cookie on the response if get_csrf_token issued a new token"""
+    if getattr(request.state, "csrf_issued", False):
+        set_csrf_cookie(response, request.state.csrf)
+    return response
 
 
 async def get_current_user(request: Request) -> Optional[str]:
     """Get current authenticated user from session cookie"""
+    # Skip the full cookie parse when the header cannot contain a session
+    raw_cookies = request.headers.get("cookie")
+    if raw_cookies is None or "session_token=" not in raw_cookies:
+        return None
+    
     session_token = request.cookies.get("session_token")
     if not session_token:
         return None
@@ -80,7 +164,11 @@ async def get_current_user(request: Request) -> Optional[str]:
 
 async def require_auth(request: Request) -> str:
     """Dependency to require authentication"""
-    username = await get_current_user(request)
+    # AuthMiddleware has already verified the session on protected paths;
+    # other routes (e.g. /api/*) verify it here
+    username = getattr(request.state, "user", None)
+    if not username:
+        username = await get_current_user(request)
     if not username:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -100,17 +188,16 @@ class AuthMiddleware(BaseHTTPMiddleware):
         self.protected_paths = protected_paths or [
             "/notes", "/upload", "/logout"
         ]
+        # Precomputed matchers: exact paths and "<path>/" prefixes
+        self._exact_paths = frozenset(self.protected_paths)
+        self._path_prefixes = tuple(p + "/" for p in self.protected_paths)
     
     async def dispatch(self, request: Request, call_next):
         path = request.url.path
         
         # Check if path needs authentication
         # Handle both exact matches and path patterns
-        needs_auth = False
-        for protected in self.protected_paths:
-            if path == protected or path.startswith(protected + "/"):
-                needs_auth = True
-                break
+        needs_auth = path in self._exact_paths or path.startswith(self._path_prefixes)
         
         if needs_auth:
             username = await get_current_user(request)
@@ -125,6 +212,7 @@ class AuthMiddleware(BaseHTTPMiddleware):
                 else:
                     from fastapi.responses import RedirectResponse
                     return RedirectResponse(url="/login", status_code=302)
+            request.state.user = username
         
         response = await call_next(request)
         return response
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os
+from pydantic import model_validator
 from pydantic_settings import BaseSettings
 from typing import Optional
 
@@ -11,6 +12,17 @@ class Settings(BaseSettings):
     secret_key: str = os.getenv("SECRET_KEY", "your-secret-key-here")
     environment: str = os.getenv("ENVIRONMENT", "development")
     aes_key: str = os.getenv("AES_KEY", "")
+    markdown_renderer: str = os.getenv("MARKDOWN_RENDERER", "cmark")
+    encrypt_html: bool = os.getenv("ENCRYPT_HTML", "true").lower() in ("1", "true", "yes")
+    encrypt_in_transit: bool = os.getenv("ENCRYPT_IN_TRANSIT", "true").lower() in ("1", "true", "yes")
+    key_version: str = os.getenv("KEY_VERSION", "1")
+    
+    @model_validator(mode="after")
+    def _plain_transit_disables_html_encryption(self) -> "Settings":
+        # With transport encryption off there is no ciphertext to embed in pages
+        if not self.encrypt_in_transit:
+            self.encrypt_html = False
+        return self
     
     @property
     def is_production(self) -> bool:
@@ -1,12 +1,19 @@
 import os
 import base64
 import hashlib
-from typing import Union
+import functools
+import logging
+import threading
+from typing import List, Union
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.backends.openssl.backend import backend
 from ..config import settings
 
+logger = logging.getLogger(__name__)
 
+
+@functools.lru_cache(maxsize=1)
 def get_aes_key() -> bytes:
     """
     Derive AES key from environment variable using SHA-256.
@@ -25,12 +32,84 @@ def get_aes_key() -> bytes:
     return hashlib.sha256(raw_key.encode('utf-8')).digest()
 
 
+@functools.lru_cache(maxsize=1)
+def _aesgcm() -> AESGCM:
+    """Return the AESGCM cipher for the configured key, built once per process"""
+    return AESGCM(get_aes_key())
+
+
 class EncryptionError(Exception):
     """Custom exception for encryption/decryption errors"""
     pass
 
 
-def encrypt_data(plaintext: Union[str, bytes]) -> str:
+NONCE_SIZE = 12
+_NONCE_POOL_SIZE = 4096
+_nonce_pool = threading.local()
+
+
+def _nonce() -> bytes:
+    """
+    Return a fresh random 12-byte GCM nonce.
+    
+    Nonces are carved from a per-thread buffer of os.urandom output so bulk
+    encryption makes one getrandom syscall per ~340 nonces. The buffer is
+    discarded after a fork so parent and child never hand out the same bytes.
+    """
+    pool = _nonce_pool
+    pid = os.getpid()
+    if getattr(pool, "pid", None) != pid or pool.offset + NONCE_SIZE > len(pool.buffer):
+        pool.buffer = os.urandom(_NONCE_POOL_SIZE)
+        pool.offset = 0
+        pool.pid = pid
+    start = pool.offset
+    pool.offset = start + NONCE_SIZE
+    return pool.buffer[start:start + NONCE_SIZE]
+
+
+def _encrypt_one(aesgcm: AESGCM, plaintext: Union[str, bytes]) -> str:
+    """Encrypt a single value with an existing cipher"""
+    # Empty values are sent as-is, matching the client's encryptData('')
+    if not plaintext:
+        return ""
+    
+    if isinstance(plaintext, str):
+        plaintext = plaintext.encode('utf-8')
+    
+    # Random 12-byte nonce for GCM
+    nonce = _nonce()
+    
+    # Encrypt data
+    ciphertext = aesgcm.encrypt(nonce, plaintext, None)
+    
+    # Combine nonce + ciphertext and encode as base64
+    encrypted_data = nonce + ciphertext
+    return base64.b64encode(encrypted_data).decode('ascii')
+
+
+def _decrypt_one(aesgcm: AESGCM, encrypted_data: str) -> str:
+    """Decrypt a single value with an existing cipher"""
+    if not encrypted_data:
+        return ""
+    
+    # Decode base64 (b64decode accepts ASCII str directly)
+    combined_data = base64.b64decode(encrypted_data)
+    
+    if len(combined_data) < NONCE_SIZE:
+        raise EncryptionError("Invalid encrypted data: too short")
+    
+    # Extract nonce (first 12 bytes) and ciphertext (remainder) without copying
+    combined_view = memoryview(combined_data)
+    nonce = combined_view[:NONCE_SIZE]
+    ciphertext = combined_view[NONCE_SIZE:]
+    
+    # Decrypt data
+    plaintext = aesgcm.decrypt(nonce, ciphertext, None)
+    
+    return plaintext.decode('utf-8')
+
+
+def _encrypt_data(plaintext: Union[str, bytes]) -> str:
     """
     Encrypt data using AES-GCM with hard-coded key.
     
@@ -44,28 +123,12 @@ def encrypt_data(plaintext: Union[str, bytes]) -> str:
         EncryptionError: If encryption fails
     """
     try:
-        if isinstance(plaintext, str):
-            plaintext = plaintext.encode('utf-8')
-        
-        # Create AESGCM cipher
-        aes_key = get_aes_key()
-        aesgcm = AESGCM(aes_key)
-        
-        # Generate random 12-byte nonce for GCM
-        nonce = os.urandom(12)
-        
-        # Encrypt data
-        ciphertext = aesgcm.encrypt(nonce, plaintext, None)
-        
-        # Combine nonce + ciphertext and encode as base64
-        encrypted_data = nonce + ciphertext
-        return base64.b64encode(encrypted_data).decode('ascii')
-        
+        return _encrypt_one(_aesgcm(), plaintext)
     except Exception as e:
         raise EncryptionError(f"Encryption failed: {str(e)}")
 
 
-def decrypt_data(encrypted_data: str) -> str:
+def _decrypt_data(encrypted_data: str) -> str:
     """
     Decrypt base64-encoded AES-GCM encrypted data.
     
@@ -79,25 +142,51 @@ def decrypt_data(encrypted_data: str) -> str:
         EncryptionError: If decryption fails or data is invalid
     """
     try:
-        # Decode base64
-        combined_data = base64.b64decode(encrypted_data.encode('ascii'))
-        
-        if len(combined_data) < 12:
-            raise EncryptionError("Invalid encrypted data: too short")
-        
-        # Extract nonce (first 12 bytes) and ciphertext (remainder)
-        nonce = combined_data[:12]
-        ciphertext = combined_data[12:]
+        return _decrypt_one(_aesgcm(), encrypted_data)
+    except InvalidTag:
+        raise EncryptionError("Decryption failed: invalid authentication tag")
+    except ValueError as e:
+        raise EncryptionError(f"Decryption failed: invalid data format - {str(e)}")
+    except Exception as e:
+        raise EncryptionError(f"Decryption failed: {str(e)}")
+
+
+def _encrypt_many(plaintexts: List[Union[str, bytes]]) -> List[str]:
+    """
+    Encrypt several values, looking up the cipher only once.
+    
+    Args:
+        plaintexts: Strings or bytes to encrypt
         
-        # Create AESGCM cipher
-        aes_key = get_aes_key()
-        aesgcm = AESGCM(aes_key)
+    Returns:
+        Base64-encoded nonce + ciphertext strings, in input order
         
-        # Decrypt data
-        plaintext = aesgcm.decrypt(nonce, ciphertext, None)
+    Raises:
+        EncryptionError: If any encryption fails
+    """
+    try:
+        aesgcm = _aesgcm()
+        return [_encrypt_one(aesgcm, plaintext) for plaintext in plaintexts]
+    except Exception as e:
+        raise EncryptionError(f"Encryption failed: {str(e)}")
+
+
+def _decrypt_many(encrypted_values: List[str]) -> List[str]:
+    """
+    Decrypt several base64-encoded AES-GCM values, looking up the cipher only once.
+    
+    Args:
+        encrypted_values: Base64-encoded nonce + ciphertext strings
         
-        return plaintext.decode('utf-8')
+    Returns:
+        Decrypted strings, in input order
         
+    Raises:
+        EncryptionError: If any value fails to decrypt
+    """
+    try:
+        aesgcm = _aesgcm()
+        return [_decrypt_one(aesgcm, value) for value in encrypted_values]
     except InvalidTag:
         raise EncryptionError("Decryption failed: invalid authentication tag")
     except ValueError as e:
@@ -106,6 +195,30 @@ def decrypt_data(encrypted_data: str) -> str:
         raise EncryptionError(f"Decryption failed: {str(e)}")
 
 
+def _passthrough(value: Union[str, bytes]) -> str:
+    """Return the value unchanged, as text"""
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value or ""
+
+
+def _passthrough_many(values: List[Union[str, bytes]]) -> List[str]:
+    """Return the values unchanged, as text"""
+    return [_passthrough(value) for value in values]
+
+
+# With ENCRYPT_IN_TRANSIT=false, TLS is trusted to protect the transport and
+# the public helpers are bound to pass-throughs once, at import.
+if settings.encrypt_in_transit:
+    encrypt_data = _encrypt_data
+    decrypt_data = _decrypt_data
+    encrypt_many = _encrypt_many
+    decrypt_many = _decrypt_many
+else:
+    encrypt_data = decrypt_data = _passthrough
+    encrypt_many = decrypt_many = _passthrough_many
+
+
 def encrypt_json_field(data: dict, field: str) -> dict:
     """
     Encrypt a specific field in a dictionary.
@@ -135,4 +248,32 @@ def decrypt_json_field(data: dict, field: str) -> dict:
     """
     if field in data and data[field] is not None:
         data[field] = decrypt_data(str(data[field]))
-    return data
\ No newline at end of file
+    return data
+
+
+def _cpu_has_aes() -> Union[bool, None]:
+    """Read the CPU feature flags on Linux; None when they are unavailable"""
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            for line in cpuinfo:
+                # "flags" on x86 (aes = AES-NI), "Features" on ARM (aes = ARMv8 crypto)
+                if line.startswith(("flags", "Features")):
+                    return "aes" in line.split(":", 1)[1].split()
+    except OSError:
+        pass
+    return None
+
+
+def check_crypto_backend() -> bool:
+    """
+    Log the OpenSSL build used by AESGCM and warn if the CPU lacks hardware AES.
+    
+    Returns:
+        False if the CPU is known to lack AES instructions, True otherwise
+    """
+    has_aes = _cpu_has_aes()
+    logger.info(f"AES-GCM backend: {backend.openssl_version_text()}, hardware AES: {has_aes}")
+    if has_aes is False:
+        logger.warning("CPU does not report AES instructions; AES-GCM will use OpenSSL's software fallback")
+        return False
+    return True
@@ -1,18 +1,110 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+import logging
 import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Tuple
 
 from app.config import settings
 from app.routers import auth, notes
-from app.auth.auth import get_current_user, AuthMiddleware
+from app.auth.auth import AuthMiddleware
+from app.crypto.encryption import EncryptionError, check_crypto_backend
+from app.rendering import renderer
+from app.repositories.firestore import get_repository
+from app.templating import warm_templates
+
+logger = logging.getLogger(__name__)
+
+
+# Worker threads for the default executor, which runs the batched note
+# encryption off the event loop. Same size as ThreadPoolExecutor's own
+# default: the AES calls release the GIL, and the extra threads keep
+# short tasks moving while others block
+DEFAULT_EXECUTOR_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+
+# Loggers whose handlers move behind the queue: the root logger, plus the
+# server loggers that keep their own handlers and don't propagate to it
+QUEUED_LOGGERS = ("", "uvicorn", "uvicorn.error", "uvicorn.access", "gunicorn.error", "gunicorn.access")
+
+
+def start_log_queue() -> List[Tuple[logging.Logger, QueueListener]]:
+    """
+    Put each queued logger's handlers behind a queue so their I/O runs on a
+    listener thread instead of blocking the event loop. Records are still
+    formatted on the calling thread when they are enqueued.
+    
+    Returns:
+        The started listener for each logger that had handlers; pass the list
+        to stop_log_queue to flush and restore the handlers
+    """
+    listeners = []
+    for name in QUEUED_LOGGERS:
+        target = logging.getLogger(name)
+        handlers = target.handlers[:]
+        if not handlers:
+            if name:
+                continue
+            handlers = [logging.StreamHandler()]
+        for handler in target.handlers[:]:
+            target.removeHandler(handler)
+        
+        log_queue = queue.SimpleQueue()
+        target.addHandler(QueueHandler(log_queue))
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        listeners.append((target, listener))
+    return listeners
+
+
+def stop_log_queue(listeners: List[Tuple[logging.Logger, QueueListener]]) -> None:
+    """Flush queued records and hand the original handlers back to their loggers"""
+    for target, listener in listeners:
+        listener.stop()
+        for handler in target.handlers[:]:
+            if isinstance(handler, QueueHandler):
+                target.removeHandler(handler)
+        for handler in listener.handlers:
+            target.addHandler(handler)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_listeners = start_log_queue()
+    executor = ThreadPoolExecutor(max_workers=DEFAULT_EXECUTOR_WORKERS, thread_name_prefix="worker")
+    asyncio.get_running_loop().set_default_executor(executor)
+    
+    # Compile every template up front so the first requests don't pay for it
+    warm_templates()
+    
+    renderer.warm_up()
+    renderer.start_process_pool()
+    check_crypto_backend()
+    
+    # Create the Firestore client now rather than on the first request
+    try:
+        get_repository()
+    except Exception as e:
+        logger.warning(f"Firestore repository not initialised at startup: {e}")
+    yield
+    renderer.stop_process_pool()
+    executor.shutdown(wait=False)
+    stop_log_queue(log_listeners)
+
 
 app = FastAPI(
     title="Markdown Notes",
     description="Single-user markdown note-taking application",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    # Serialize JSON responses (the /api/* endpoints) with orjson
+    default_response_class=ORJSONResponse
 )
 
 # Security middleware
@@ -24,18 +116,35 @@ app.add_middleware(AuthMiddleware)
 # Mount static files
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
-# Templates
-templates = Jinja2Templates(directory="app/templates")
-
 # Include routers
 app.include_router(auth.router, tags=["authentication"])
 app.include_router(notes.router, tags=["notes"])
 
+
+# Routes let server-side failures propagate and get a fixed detail rather than
+# a formatted exception. EncryptionError is handled (and logged) here; any
+# other exception reaches Starlette's ServerErrorMiddleware, which re-raises
+# it after sending the response so the server logs the traceback once.
+ENCRYPTION_ERROR_DETAIL = {"detail": "Encryption error"}
+INTERNAL_ERROR_DETAIL = {"detail": "Internal server error"}
+
+
+@app.exception_handler(EncryptionError)
+async def encryption_error_handler(request: Request, exc: EncryptionError):
+    logger.exception("Encryption failed for %s %s", request.method, request.url.path)
+    return ORJSONResponse(status_code=500, content=ENCRYPTION_ERROR_DETAIL)
+
+
+@app.exception_handler(Exception)
+async def unhandled_exception_handler(request: Request, exc: Exception):
+    return ORJSONResponse(status_code=500, content=INTERNAL_ERROR_DETAIL)
+
+
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
-    # Check if user is authenticated, redirect accordingly
-    current_user = await get_current_user(request)
-    if current_user:
+    # Only check for a session cookie; /notes verifies the token itself
+    has_session = bool(request.cookies.get("session_token"))
+    if has_session:
         return RedirectResponse(url="/notes", status_code=302)
     else:
         return RedirectResponse(url="/login", status_code=302)
@@ -1,6 +1,7 @@
+from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, field_validator
 
 
 class Note(BaseModel):
@@ -8,24 +9,22 @@ class Note(BaseModel):
     id: Optional[str] = None
     title: str = Field(..., max_length=255, description="Note title (max 255 chars)")
     content: str = Field(..., description="Note content in markdown format")
+    content_preview: Optional[str] = Field(None, description="Stored preview of the content, if loaded")
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
     
-    @validator('title')
+    @field_validator('title')
+    @classmethod
     def validate_title(cls, v):
         if not v or not v.strip():
             raise ValueError('Title cannot be empty')
         return v.strip()
     
-    @validator('content')
+    @field_validator('content')
+    @classmethod
     def validate_content(cls, v):
         # Content can be empty, but if provided should be a string
         return v if v is not None else ""
-    
-    class Config:
-        json_encoders = {
-            datetime: lambda v: v.isoformat() if v else None
-        }
 
 
 class NoteCreate(BaseModel):
@@ -33,7 +32,8 @@ class NoteCreate(BaseModel):
     title: str = Field(..., max_length=255)
     content: str = ""
     
-    @validator('title')
+    @field_validator('title')
+    @classmethod
     def validate_title(cls, v):
         if not v or not v.strip():
             raise ValueError('Title cannot be empty')
@@ -45,7 +45,8 @@ class NoteUpdate(BaseModel):
     title: Optional[str] = Field(None, max_length=255)
     content: Optional[str] = None
     
-    @validator('title')
+    @field_validator('title')
+    @classmethod
     def validate_title(cls, v):
         if v is not None and (not v or not v.strip()):
             raise ValueError('Title cannot be empty')
@@ -59,11 +60,16 @@ class NoteResponse(BaseModel):
     content: str
     created_at: datetime
     updated_at: datetime
-    
-    class Config:
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
+
+
+@dataclass(slots=True)
+class NoteView:
+    """Note fields handed to templates and API responses, with title and content ready to send"""
+    id: Optional[str]
+    title: str
+    content: str
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
 
 
 class NoteSummary(BaseModel):
@@ -73,16 +79,19 @@ class NoteSummary(BaseModel):
     content_preview: str = Field(..., description="First 200 chars of content")
     created_at: datetime
     updated_at: datetime
-    
-    class Config:
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
+
+
+def make_content_preview(content: str) -> str:
+    """Build the list preview for a note's content"""
+    return content[:200] + "..." if len(content) > 200 else content
 
 
 def create_note_summary(note: Note) -> NoteSummary:
     """Create a summary from a full note"""
-    preview = note.content[:200] + "..." if len(note.content) > 200 else note.content
+    if note.content_preview is not None:
+        preview = note.content_preview
+    else:
+        preview = make_content_preview(note.content)
     return NoteSummary(
         id=note.id,
         title=note.title,
@@ -0,0 +1,257 @@
+import asyncio
+import functools
+import hashlib
+import html
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Hashable, Optional
+
+import markdown
+from cachetools import LRUCache
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
+
+from ..config import settings
+
+try:
+    import cmarkgfm
+    from cmarkgfm.cmark import Options as CmarkOptions
+except ImportError:  # pragma: no cover - optional native renderer
+    cmarkgfm = None
+
+logger = logging.getLogger(__name__)
+
+# Constructing a Markdown instance loads every extension, so keep built
+# instances in a pool and reset() them between documents. An instance is not
+# reentrant, so each render checks one out; instances are created on demand,
+# at most one per concurrently rendering thread.
+#
+# codehilite runs Pygments over every code block, so notes without fenced
+# code use a separate pool of instances that only load 'extra'.
+def _new_markdown(highlight_code: bool) -> markdown.Markdown:
+    extensions = ['extra', 'codehilite'] if highlight_code else ['extra']
+    return markdown.Markdown(extensions=extensions)
+
+
+_markdown_pools: "dict[bool, queue.SimpleQueue[markdown.Markdown]]" = {
+    True: queue.SimpleQueue(),
+    False: queue.SimpleQueue(),
+}
+
+
+def _has_fenced_code(content: str) -> bool:
+    return '```' in content or '~~~' in content
+
+# Rendered HTML keyed by a digest of the source, so repeated previews of an
+# unchanged note skip the markdown pipeline. Edits produce a new key; stale
+# entries simply age out of the LRU.
+RENDER_CACHE_SIZE = 1024
+_render_cache = LRUCache(maxsize=RENDER_CACHE_SIZE)
+_render_cache_lock = threading.Lock()
+
+# Rendering is CPU-bound; cache misses run here so a slow render does not
+# stall the event loop for every other request.
+_RENDER_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="markdown")
+
+# cmark-gfm releases the GIL, so its renders already run in parallel on the
+# threads above. Python-Markdown holds it; with that renderer on multi-core
+# hosts cache misses go to worker processes instead (see start_process_pool).
+# Workers are spawned rather than forked so they don't inherit the server's
+# threads and locks.
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+# cmark-gfm emits fenced blocks as <pre lang="x"><code>; highlight those with
+# Pygments using the same markup codehilite produces so the preview CSS applies.
+_CMARK_OPTIONS = CmarkOptions.CMARK_OPT_UNSAFE | CmarkOptions.CMARK_OPT_GITHUB_PRE_LANG if cmarkgfm else 0
+_CODE_BLOCK_RE = re.compile(r'<pre lang="([^"]+)"><code>(.*?)</code></pre>', re.DOTALL)
+_code_formatter = HtmlFormatter(cssclass="codehilite", wrapcode=True)
+
+# Languages likely to appear in notes; loading their lexer modules up front
+# keeps the import cost off the first preview that uses them
+PREWARM_LANGUAGES = (
+    'python', 'javascript', 'typescript', 'bash', 'sql', 'json', 'yaml',
+    'go', 'rust', 'html', 'css',
+)
+
+
+def _use_cmark() -> bool:
+    if settings.markdown_renderer.lower() != "cmark":
+        return False
+    if cmarkgfm is None:
+        logger.warning("MARKDOWN_RENDERER=cmark but cmarkgfm is not installed; using python-markdown")
+        return False
+    return True
+
+
+_USE_CMARK = _use_cmark()
+
+
+@functools.lru_cache(maxsize=128)
+def _lexer_for(language: str):
+    """Resolve a fence language to a reusable Pygments lexer, or None if unknown"""
+    try:
+        return get_lexer_by_name(language)
+    except ClassNotFound:
+        return None
+
+
+def _highlight_block(match: re.Match) -> str:
+    lexer = _lexer_for(html.unescape(match.group(1)).lower())
+    if lexer is None:
+        return match.group(0)
+    return highlight(html.unescape(match.group(2)), lexer, _code_formatter)
+
+
+def warm_up() -> None:
+    """Load the common Pygments lexers so the first highlighted preview doesn't pay for it"""
+    for language in PREWARM_LANGUAGES:
+        _lexer_for(language)
+
+
+def _render_cmark(content: str) -> str:
+    rendered = cmarkgfm.github_flavored_markdown_to_html(content, options=_CMARK_OPTIONS)
+    if '<pre lang="' not in rendered:
+        return rendered
+    return _CODE_BLOCK_RE.sub(_highlight_block, rendered)
+
+
+def _render_python_markdown(content: str) -> str:
+    highlight_code = _has_fenced_code(content)
+    pool = _markdown_pools[highlight_code]
+    try:
+        md = pool.get_nowait()
+    except queue.Empty:
+        md = _new_markdown(highlight_code)
+    try:
+        return md.reset().convert(content)
+    finally:
+        pool.put(md)
+
+
+def _content_key(content: str) -> bytes:
+    return hashlib.blake2b(content.encode(), digest_size=16).digest()
+
+
+def _cached_render(key: Hashable) -> Optional[str]:
+    with _render_cache_lock:
+        return _render_cache.get(key)
+
+
+def _render(content: str) -> str:
+    """Render without the cache; runs in worker processes, so it must stay picklable by name"""
+    return _render_cmark(content) if _USE_CMARK else _render_python_markdown(content)
+
+
+def _store(key: Hashable, html_content: str) -> str:
+    with _render_cache_lock:
+        _render_cache[key] = html_content
+    return html_content
+
+
+def _render_and_store(key: Hashable, content: str) -> str:
+    return _store(key, _render(content))
+
+
+def _warm_worker() -> int:
+    """Load the renderer and lexers in a fresh worker process"""
+    warm_up()
+    _render("```python\nx = 1\n```\n")
+    return os.getpid()
+
+
+def start_process_pool(max_workers: Optional[int] = None) -> Optional[ProcessPoolExecutor]:
+    """
+    Start and warm the worker processes used for cache misses in
+    render_markdown_async when rendering with Python-Markdown.
+    
+    Args:
+        max_workers: Number of processes; defaults to the CPU count
+        
+    Returns:
+        The pool, or None when using cmark, on a single CPU or when processes
+        cannot be started; rendering then stays on the thread pool
+    """
+    global _process_pool
+    if _USE_CMARK:
+        return None
+    workers = max_workers or os.cpu_count() or 1
+    if workers < 2:
+        logger.info("Single CPU; markdown renders on the thread pool")
+        return None
+    try:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    except (OSError, NotImplementedError) as e:
+        logger.warning(f"Markdown process pool unavailable, rendering on threads: {e}")
+        return None
+    try:
+        # One warm-up task per worker spawns them all now, so no request pays
+        # for process start-up and imports
+        for future in wait([pool.submit(_warm_worker) for _ in range(workers)]).done:
+            future.result()
+    except Exception as e:
+        pool.shutdown(wait=False, cancel_futures=True)
+        logger.warning(f"Markdown worker processes failed to start, rendering on threads: {e}")
+        return None
+    _process_pool = pool
+    return _process_pool
+
+
+def _drop_broken_pool(pool: ProcessPoolExecutor) -> None:
+    """Stop using a pool whose worker died; later renders stay on the thread pool"""
+    global _process_pool
+    # Concurrent renders can all fail on the same pool; only the first drops it
+    if _process_pool is pool:
+        _process_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        logger.error("Markdown worker process died; rendering on threads from now on")
+
+
+def stop_process_pool() -> None:
+    """Shut down the worker processes, if any"""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def render_markdown(content: str, key: Optional[Hashable] = None) -> str:
+    """
+    Render markdown content to HTML, reusing cached output.
+    
+    Pass a key that changes whenever the content does, such as
+    (note_id, updated_at), to skip hashing the content; otherwise the
+    content's digest is the key.
+    """
+    if key is None:
+        key = _content_key(content)
+    cached = _cached_render(key)
+    if cached is not None:
+        return cached
+    return _render_and_store(key, content)
+
+
+async def render_markdown_async(content: str, key: Optional[Hashable] = None) -> str:
+    """Render markdown off the event loop; cache hits are answered inline. See render_markdown for key"""
+    if key is None:
+        key = _content_key(content)
+    cached = _cached_render(key)
+    if cached is not None:
+        return cached
+    loop = asyncio.get_running_loop()
+    pool = _process_pool
+    if pool is not None:
+        try:
+            html_content = await loop.run_in_executor(pool, _render, content)
+        except BrokenProcessPool:
+            _drop_broken_pool(pool)
+        else:
+            return _store(key, html_content)
+    return await loop.run_in_executor(_RENDER_POOL, _render_and_store, key, content)
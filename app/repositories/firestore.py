@@ -1,14 +1,66 @@
-from datetime import datetime
+import asyncio
+from datetime import datetime, timezone
+from functools import lru_cache
 from typing import List, Optional
+import base64
+import binascii
 import logging
+import re
+from cachetools import TTLCache
+from google.api_core.exceptions import NotFound
 from google.cloud import firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
 
-from app.models.notes import Note, NoteCreate, NoteUpdate
+from app.models.notes import Note, NoteCreate, NoteUpdate, make_content_preview
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Fields needed to render note lists; the full content is not fetched
+SUMMARY_FIELDS = ["title", "content_preview", "created_at", "updated_at"]
+
+# Search tokens: lowercased words of 2-32 chars, capped to stay well under
+# Firestore's per-document index entry limit
+_TOKEN_RE = re.compile(r"\w+")
+MAX_SEARCH_TOKENS = 2000
+
+# Recently read notes, so reopening the editor or preview skips Firestore.
+# Writes through this repository keep it current; the short TTL bounds how
+# stale it can get when another instance changes a note.
+NOTE_CACHE_SIZE = 512
+NOTE_CACHE_TTL = 30
+
+# Documents requested per BatchGetDocuments call
+GET_ALL_BATCH_SIZE = 500
+
+
+def make_search_tokens(text: str) -> List[str]:
+    """Extract the unique search tokens of a text, in order of first occurrence"""
+    tokens = dict.fromkeys(
+        t for t in _TOKEN_RE.findall(text.lower()) if 2 <= len(t) <= 32
+    )
+    return list(tokens)[:MAX_SEARCH_TOKENS]
+
+
+def note_cursor(note: Note) -> str:
+    """Encode a note's position in the updated_at ordering as an opaque cursor"""
+    raw = f"{note.updated_at.isoformat()}|{note.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode("ascii")
+
+
+def decode_note_cursor(cursor: str) -> dict:
+    """
+    Decode a cursor produced by note_cursor into Firestore cursor values.
+    
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        updated_at, note_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode().split("|", 1)
+        return {"updated_at": datetime.fromisoformat(updated_at), "__name__": note_id}
+    except (UnicodeError, binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
 
 class FirestoreRepository:
     """Firestore repository for notes management"""
@@ -16,11 +68,12 @@ class FirestoreRepository:
     def __init__(self):
         try:
             if settings.firestore_project:
-                self.db = firestore.Client(project=settings.firestore_project)
+                self.db = firestore.AsyncClient(project=settings.firestore_project)
             else:
                 # Use default project from environment
-                self.db = firestore.Client()
+                self.db = firestore.AsyncClient()
             self.collection_name = "notes"
+            self._note_cache = TTLCache(maxsize=NOTE_CACHE_SIZE, ttl=NOTE_CACHE_TTL)
         except Exception as e:
             logger.error(f"Failed to initialize Firestore client: {e}")
             raise
@@ -31,10 +84,12 @@ class FirestoreRepository:
             return None
         
         data = doc.to_dict()
-        return Note(
+        # Stored notes were validated on write; skip re-validating them on every read
+        return Note.model_construct(
             id=doc.id,
             title=data.get("title", ""),
             content=data.get("content", ""),
+            content_preview=data.get("content_preview"),
             created_at=data.get("created_at"),
             updated_at=data.get("updated_at")
         )
@@ -42,71 +97,148 @@ class FirestoreRepository:
     async def create_note(self, note_data: NoteCreate) -> Note:
         """Create a new note in Firestore"""
         try:
-            now = datetime.utcnow()
+            now = datetime.now(timezone.utc)
             doc_data = {
                 "title": note_data.title,
                 "content": note_data.content,
+                "content_preview": make_content_preview(note_data.content),
+                "tokens": make_search_tokens(f"{note_data.title} {note_data.content}"),
                 "created_at": now,
                 "updated_at": now
             }
             
             # Add document and get reference
-            doc_ref = self.db.collection(self.collection_name).add(doc_data)[1]
+            _, doc_ref = await self.db.collection(self.collection_name).add(doc_data)
             
             # Return the created note
-            return Note(
+            note = Note(
                 id=doc_ref.id,
                 title=note_data.title,
                 content=note_data.content,
                 created_at=now,
                 updated_at=now
             )
+            self._note_cache[note.id] = note
+            return note
         except Exception as e:
             logger.error(f"Error creating note: {e}")
             raise
     
     async def get_note(self, note_id: str) -> Optional[Note]:
         """Get a single note by ID"""
+        note = self._note_cache.get(note_id)
+        if note is not None:
+            return note
         try:
             doc_ref = self.db.collection(self.collection_name).document(note_id)
-            doc = doc_ref.get()
-            return self._doc_to_note(doc)
+            doc = await doc_ref.get()
+            note = self._doc_to_note(doc)
+            if note is not None:
+                self._note_cache[note_id] = note
+            return note
         except Exception as e:
             logger.error(f"Error getting note {note_id}: {e}")
             raise
     
-    async def get_notes(self, limit: int = 50, offset: int = 0) -> List[Note]:
-        """Get paginated list of notes, ordered by updated_at desc"""
+    async def get_notes_by_ids(self, note_ids: List[str]) -> List[Note]:
+        """
+        Get several notes in the order given; missing notes are skipped.
+        
+        Cached notes are served from memory. The rest are read with get_all in
+        batches of GET_ALL_BATCH_SIZE, all issued concurrently, so the wait is
+        one round trip rather than one per note.
+        """
+        try:
+            found = {}
+            missing = []
+            for note_id in dict.fromkeys(note_ids):
+                note = self._note_cache.get(note_id)
+                if note is not None:
+                    found[note_id] = note
+                else:
+                    missing.append(note_id)
+            
+            batches = [missing[start:start + GET_ALL_BATCH_SIZE]
+                       for start in range(0, len(missing), GET_ALL_BATCH_SIZE)]
+            for notes in await asyncio.gather(*(self._get_all(batch) for batch in batches)):
+                for note in notes:
+                    found[note.id] = note
+                    self._note_cache[note.id] = note
+            return [found[note_id] for note_id in note_ids if note_id in found]
+        except Exception as e:
+            logger.error(f"Error getting notes by id: {e}")
+            raise
+    
+    async def _get_all(self, note_ids: List[str]) -> List[Note]:
+        """Read one batch of notes with a single get_all call"""
+        collection = self.db.collection(self.collection_name)
+        refs = [collection.document(note_id) for note_id in note_ids]
+        notes = []
+        async for doc in self.db.get_all(refs):
+            note = self._doc_to_note(doc)
+            if note is not None:
+                notes.append(note)
+        return notes
+    
+    async def get_notes(
+        self,
+        limit: int = 50,
+        offset: int = 0,
+        start_after: Optional[str] = None
+    ) -> List[Note]:
+        """
+        Get paginated list of notes, ordered by updated_at desc.
+        
+        Pass the cursor of the last note of the previous page (see
+        note_cursor) as start_after; Firestore then seeks to it through the
+        index instead of reading and discarding offset documents.
+        """
         try:
             query = (self.db.collection(self.collection_name)
+                    .select(SUMMARY_FIELDS)
                     .order_by("updated_at", direction=firestore.Query.DESCENDING)
-                    .limit(limit)
-                    .offset(offset))
+                    .order_by("__name__", direction=firestore.Query.DESCENDING)
+                    .limit(limit))
+            
+            if start_after:
+                query = query.start_after(decode_note_cursor(start_after))
+            elif offset:
+                query = query.offset(offset)
             
-            docs = query.stream()
             notes = []
-            for doc in docs:
+            async for doc in query.stream():
                 note = self._doc_to_note(doc)
                 if note:
                     notes.append(note)
             
-            return notes
+            return await self._fill_missing_previews(notes)
         except Exception as e:
             logger.error(f"Error getting notes: {e}")
             raise
     
+    async def _fill_missing_previews(self, notes: List[Note]) -> List[Note]:
+        """
+        Compute content_preview for notes written before previews were stored.
+        
+        Their content comes from one batched read and the preview is only set
+        in memory; reads never write, reindex_notes stores the previews.
+        """
+        legacy_ids = [note.id for note in notes if note.content_preview is None]
+        if legacy_ids:
+            full_notes = {note.id: note for note in await self._get_all(legacy_ids)}
+            for note in notes:
+                if note.content_preview is None and note.id in full_notes:
+                    note.content_preview = make_content_preview(full_notes[note.id].content)
+        return notes
+    
     async def update_note(self, note_id: str, note_update: NoteUpdate) -> Optional[Note]:
         """Update an existing note"""
         try:
             doc_ref = self.db.collection(self.collection_name).document(note_id)
             
-            # Check if note exists
-            if not doc_ref.get().exists:
-                return None
-            
             # Prepare update data
             update_data = {
-                "updated_at": datetime.utcnow()
+                "updated_at": datetime.now(timezone.utc)
             }
             
             if note_update.title is not None:
@@ -114,13 +246,36 @@ class FirestoreRepository:
             
             if note_update.content is not None:
                 update_data["content"] = note_update.content
+                update_data["content_preview"] = make_content_preview(note_update.content)
+            
+            if note_update.title is not None and note_update.content is not None:
+                update_data["tokens"] = make_search_tokens(f"{note_update.title} {note_update.content}")
+            elif note_update.title is not None or note_update.content is not None:
+                # Partial update: the tokens also depend on the stored field
+                existing = await doc_ref.get()
+                if not existing.exists:
+                    self._note_cache.pop(note_id, None)
+                    return None
+                current = existing.to_dict()
+                title = note_update.title if note_update.title is not None else current.get("title", "")
+                content = note_update.content if note_update.content is not None else current.get("content", "")
+                update_data["tokens"] = make_search_tokens(f"{title} {content}")
             
-            # Update document
-            doc_ref.update(update_data)
+            # Update document; update() itself fails if the note does not exist
+            try:
+                await doc_ref.update(update_data)
+            except NotFound:
+                self._note_cache.pop(note_id, None)
+                return None
             
             # Return updated note
-            updated_doc = doc_ref.get()
-            return self._doc_to_note(updated_doc)
+            updated_doc = await doc_ref.get()
+            note = self._doc_to_note(updated_doc)
+            if note is not None:
+                self._note_cache[note_id] = note
+            else:
+                self._note_cache.pop(note_id, None)
+            return note
             
         except Exception as e:
             logger.error(f"Error updating note {note_id}: {e}")
@@ -131,66 +286,90 @@ class FirestoreRepository:
         try:
             doc_ref = self.db.collection(self.collection_name).document(note_id)
             
-            # Check if note exists before deletion
-            if not doc_ref.get().exists:
+            # Precondition makes the delete fail for missing notes, no read needed
+            self._note_cache.pop(note_id, None)
+            try:
+                await doc_ref.delete(option=self.db.write_option(exists=True))
+            except NotFound:
                 return False
-            
-            doc_ref.delete()
             return True
         except Exception as e:
             logger.error(f"Error deleting note {note_id}: {e}")
             raise
     
     async def search_notes(self, query: str, limit: int = 50) -> List[Note]:
-        """Search notes by title and content"""
+        """Search notes by whole words in title and content"""
         try:
-            notes = []
-            
-            # Firestore doesn't support full-text search natively
-            # We'll implement a simple search by fetching all notes and filtering
-            # In production, you might want to use Firestore's array-contains
-            # or implement external search with Elasticsearch/Algolia
+            terms = make_search_tokens(query)
+            if not terms:
+                return []
             
-            all_docs = (self.db.collection(self.collection_name)
-                       .order_by("updated_at", direction=firestore.Query.DESCENDING)
-                       .limit(1000)  # Reasonable limit for search
-                       .stream())
+            # Let the index filter on the most selective (longest) term and
+            # check any remaining terms against each document's tokens
+            lead_term = max(terms, key=len)
+            other_terms = [t for t in terms if t != lead_term]
             
-            query_lower = query.lower()
+            # tokens are only read back to check the other terms
+            fields = SUMMARY_FIELDS + ["tokens"] if other_terms else SUMMARY_FIELDS
+            search_query = (self.db.collection(self.collection_name)
+                           .select(fields)
+                           .where(filter=FieldFilter("tokens", "array_contains", lead_term))
+                           .order_by("updated_at", direction=firestore.Query.DESCENDING))
+            if not other_terms:
+                search_query = search_query.limit(limit)
             
-            for doc in all_docs:
+            notes = []
+            async for doc in search_query.stream():
+                if other_terms:
+                    doc_tokens = set(doc.get("tokens") or ())
+                    if not all(t in doc_tokens for t in other_terms):
+                        continue
                 note = self._doc_to_note(doc)
-                if note and (
-                    query_lower in note.title.lower() or 
-                    query_lower in note.content.lower()
-                ):
+                if note:
                     notes.append(note)
                     if len(notes) >= limit:
                         break
             
-            return notes
+            return await self._fill_missing_previews(notes)
         except Exception as e:
             logger.error(f"Error searching notes: {e}")
             raise
     
+    async def reindex_notes(self) -> int:
+        """Rebuild stored previews and search tokens for every note"""
+        try:
+            count = 0
+            async for doc in self.db.collection(self.collection_name).stream():
+                data = doc.to_dict()
+                title = data.get("title", "")
+                content = data.get("content", "")
+                await doc.reference.update({
+                    "content_preview": make_content_preview(content),
+                    "tokens": make_search_tokens(f"{title} {content}")
+                })
+                count += 1
+            return count
+        except Exception as e:
+            logger.error(f"Error reindexing notes: {e}")
+            raise
+    
     async def get_notes_count(self) -> int:
         """Get total count of notes"""
         try:
-            # Firestore doesn't have a direct count method
-            # For large datasets, you'd maintain a counter document
-            docs = list(self.db.collection(self.collection_name).stream())
-            return len(docs)
+            # Server-side aggregation: no documents are transferred
+            result = await self.db.collection(self.collection_name).count().get()
+            return int(result[0][0].value)
         except Exception as e:
             logger.error(f"Error counting notes: {e}")
             raise
 
 
-# Global repository instance
-_repository = None
-
+@lru_cache(maxsize=1)
 def get_repository() -> FirestoreRepository:
-    """Get or create repository instance"""
-    global _repository
-    if _repository is None:
-        _repository = FirestoreRepository()
-    return _repository
\ No newline at end of file
+    """Get or create the process-wide repository instance"""
+    return FirestoreRepository()
+
+
+async def repository_dependency() -> FirestoreRepository:
+    """Route dependency for the shared repository; async so FastAPI calls it inline, not in the threadpool"""
+    return get_repository()
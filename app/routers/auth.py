@@ -1,25 +1,29 @@
 from datetime import timedelta
 from fastapi import APIRouter, Request, Form, HTTPException, status
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.concurrency import run_in_threadpool
 
-from app.auth.auth import authenticate_user, create_access_token, generate_csrf_token
+from app.auth.auth import (
+    authenticate_user, create_access_token, generate_csrf_token, check_csrf_token,
+    get_csrf_token, set_csrf_cookie, attach_csrf_cookie
+)
 from app.config import settings
+from app.templating import render_template
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
 
 
 @router.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
     """Display login form"""
-    csrf_token = generate_csrf_token()
+    csrf_token = get_csrf_token(request)
     
-    return templates.TemplateResponse("login.html", {
+    response = render_template("login.html", {
         "request": request,
         "title": "Login",
         "csrf_token": csrf_token
     })
+    return attach_csrf_cookie(request, response)
 
 
 @router.post("/login")
@@ -31,21 +35,23 @@ async def login(
 ):
     """Process login form submission"""
     
-    # Basic CSRF validation (in production, this should be more robust)
-    if not csrf_token or len(csrf_token) < 32:
+    # CSRF validation against the token bound to this browser
+    if not check_csrf_token(request, csrf_token):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid CSRF token"
         )
     
     # Authenticate user
-    if not authenticate_user(username, password):
-        return templates.TemplateResponse("login.html", {
+    # Argon2 verification takes a few hundred ms of CPU; keep it off the event loop
+    if not await run_in_threadpool(authenticate_user, username, password):
+        response = render_template("login.html", {
             "request": request,
             "title": "Login",
             "error": "Invalid username or password",
-            "csrf_token": generate_csrf_token()
+            "csrf_token": get_csrf_token(request)
         }, status_code=400)
+        return attach_csrf_cookie(request, response)
     
     # Create session token
     access_token_expires = timedelta(hours=24)
@@ -67,6 +73,9 @@ async def login(
         samesite=settings.cookie_samesite
     )
     
+    # Rotate the CSRF token for the new session
+    set_csrf_cookie(response, generate_csrf_token())
+    
     return response
 
 
@@ -1,61 +1,176 @@
-from fastapi import APIRouter, Request, HTTPException, Depends, Query, Form, UploadFile, File
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.templating import Jinja2Templates
+from fastapi import APIRouter, Request, Response, HTTPException, Depends, Query, Form, UploadFile, File, Header
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from typing import List, Optional
-import markdown
+from pydantic import TypeAdapter
+import asyncio
+import codecs
+import hashlib
+import logging
 import os
 
-from app.models.notes import Note, NoteCreate, NoteUpdate, NoteSummary, create_note_summary
-from app.repositories.firestore import get_repository, FirestoreRepository
-from app.auth.auth import require_auth, generate_csrf_token
-from app.crypto.encryption import encrypt_data, decrypt_data, EncryptionError
+from app.config import settings
+from app.templating import render_template
+from app.models.notes import Note, NoteCreate, NoteUpdate, NoteSummary, NoteView, make_content_preview
+from app.repositories.firestore import repository_dependency, FirestoreRepository, note_cursor
+from app.auth.auth import (
+    require_auth, check_csrf_token, get_csrf_token, attach_csrf_cookie
+)
+from app.rendering.renderer import render_markdown_async
+from app.crypto.encryption import encrypt_data, decrypt_data, encrypt_many, decrypt_many, EncryptionError
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
+logger = logging.getLogger(__name__)
+
+# Previews may be cached by the browser but must be revalidated with the ETag
+PREVIEW_CACHE_CONTROL = "private, no-cache"
+
+# Bump when preview markup changes in a way the settings below don't capture
+PREVIEW_VERSION = "1"
+
+# Everything besides the note that shapes a preview body: the AES key (by its
+# KEY_VERSION label, never the key itself, since the tag is sent to clients),
+# the encryption and renderer switches, and the deployed version (App Engine
+# sets GAE_VERSION per deploy). Any change makes browsers' cached previews
+# miss instead of revalidating as 304.
+_PREVIEW_FINGERPRINT = hashlib.blake2b("|".join([
+    PREVIEW_VERSION,
+    os.getenv("GAE_VERSION", ""),
+    settings.key_version,
+    str(settings.encrypt_html),
+    str(settings.encrypt_in_transit),
+    settings.markdown_renderer.lower(),
+]).encode(), digest_size=6).hexdigest()
+
+# Uploads are read in chunks of this many bytes
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# File extensions accepted by /upload
+_ALLOWED_EXT = frozenset({'.txt', '.md'})
+
+# Upper bound on IDs accepted by /api/notes/batch
+MAX_BATCH_IDS = 100
+
+# Non-standard status (nginx's) for requests the client abandoned mid-flight
+CLIENT_CLOSED_REQUEST = 499
+
+# Validators for form input, built once per process
+_NOTE_CREATE = TypeAdapter(NoteCreate)
+_NOTE_UPDATE = TypeAdapter(NoteUpdate)
+
+
+def _encrypt_summaries(notes: List[Note], encrypt: bool = True) -> List[dict]:
+    """Build note summaries with title and content_preview encrypted for transmission"""
+    # Encrypt the whole page in one batch, then build the summaries in order.
+    # Loop-invariant lookups are bound to locals once per page.
+    plaintexts = []
+    append = plaintexts.append
+    preview_of = make_content_preview
+    for note in notes:
+        append(note.title)
+        preview = note.content_preview
+        append(preview if preview is not None else preview_of(note.content))
+    encrypted = encrypt_many(plaintexts) if encrypt else plaintexts
+    # Pairs of (title, content_preview) in note order
+    pairs = iter(encrypted)
+    return [
+        {
+            'id': note.id,
+            'title': title,
+            'content_preview': content_preview,
+            'created_at': note.created_at,
+            'updated_at': note.updated_at,
+        }
+        for note, title, content_preview in zip(notes, pairs, pairs)
+    ]
+
+
+def _encrypt_notes(notes: List[Note], encrypt: bool = True) -> List[NoteView]:
+    """Build views of notes with title and content encrypted in one batch"""
+    plaintexts = []
+    extend = plaintexts.extend
+    for note in notes:
+        extend((note.title, note.content))
+    encrypted = encrypt_many(plaintexts) if encrypt else plaintexts
+    # Pairs of (title, content) in note order
+    pairs = iter(encrypted)
+    return [
+        NoteView(
+            id=note.id,
+            title=title,
+            content=content,
+            created_at=note.created_at,
+            updated_at=note.updated_at,
+        )
+        for note, title, content in zip(notes, pairs, pairs)
+    ]
+
+
+def _encrypt_note(note: Note, encrypt: bool = True) -> NoteView:
+    """Build the view of a note with title and content encrypted"""
+    return _encrypt_notes([note], encrypt)[0]
+
+
+def _is_valid_note_id(note_id: str) -> bool:
+    """Whether a client-supplied ID can name a document in the notes collection"""
+    return bool(note_id) and "/" not in note_id and note_id not in (".", "..")
+
+
+def _preview_etag(note: Note) -> str:
+    """Weak validator for a note's rendered preview; changes when the note is saved or the preview settings or deploy change"""
+    return f'W/"{note.id}-{int(note.updated_at.timestamp() * 1_000_000)}-{_PREVIEW_FINGERPRINT}"'
+
+
+def _not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Return a 304 response if the client already holds the preview for this etag"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": PREVIEW_CACHE_CONTROL})
+    return None
 
 
 @router.get("/notes", response_class=HTMLResponse)
 async def notes_list(
     request: Request,
     current_user: str = Depends(require_auth),
+    repository: FirestoreRepository = Depends(repository_dependency),
     search: Optional[str] = Query(None),
-    page: int = Query(1, ge=1),
+    after: Optional[str] = Query(None, description="Cursor of the last note on the previous page"),
+    page: int = Query(1, ge=1, description="Page number shown in the pager"),
     limit: int = Query(20, ge=1, le=100)
 ):
     """Display notes list page"""
-    repository = get_repository()
-    offset = (page - 1) * limit
+    next_cursor = None
+    if search:
+        notes = await repository.search_notes(search, limit)
+    else:
+        # Seek past the previous page through the index instead of an offset scan
+        try:
+            notes = await repository.get_notes(limit, start_after=after)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if len(notes) == limit:
+            next_cursor = note_cursor(notes[-1])
     
-    try:
-        if search:
-            notes = await repository.search_notes(search, limit)
-        else:
-            notes = await repository.get_notes(limit, offset)
-        
-        # Create summaries for display and encrypt sensitive fields
-        note_summaries = []
-        for note in notes:
-            summary = create_note_summary(note)
-            # Encrypt title and content_preview for transmission
-            try:
-                summary_dict = summary.dict()
-                summary_dict['title'] = encrypt_data(summary_dict['title'])
-                summary_dict['content_preview'] = encrypt_data(summary_dict['content_preview'])
-                note_summaries.append(summary_dict)
-            except EncryptionError as e:
-                raise HTTPException(status_code=500, detail=f"Encryption error: {str(e)}")
-        
-        return templates.TemplateResponse("notes_list.html", {
-            "request": request,
-            "title": "My Notes",
-            "notes": note_summaries,
-            "search": search,
-            "current_page": page,
-            "has_next": len(notes) == limit,
-            "has_prev": page > 1
-        })
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error loading notes: {str(e)}")
+    # Nobody to send the page to; skip the encryption and rendering
+    if await request.is_disconnected():
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    
+    # Create summaries for display and encrypt sensitive fields
+    if settings.encrypt_html:
+        note_summaries = await asyncio.to_thread(_encrypt_summaries, notes)
+    else:
+        note_summaries = _encrypt_summaries(notes, encrypt=False)
+    
+    return render_template("notes_list.html", {
+        "request": request,
+        "title": "My Notes",
+        "notes": note_summaries,
+        "search": search,
+        "current_page": page,
+        "next_cursor": next_cursor,
+        "has_next": next_cursor is not None,
+        "has_prev": after is not None
+    })
 
 
 @router.get("/notes/new", response_class=HTMLResponse)
@@ -64,107 +179,94 @@ async def create_note_form(
     current_user: str = Depends(require_auth)
 ):
     """Display create note form"""
-    csrf_token = generate_csrf_token()
+    csrf_token = get_csrf_token(request)
     
-    return templates.TemplateResponse("note_editor.html", {
+    response = render_template("note_editor.html", {
         "request": request,
         "title": "Create New Note",
         "note": None,
         "csrf_token": csrf_token,
         "is_editing": False
     })
+    return attach_csrf_cookie(request, response)
 
 
 @router.post("/notes", response_class=HTMLResponse)
 async def create_note(
     request: Request,
     current_user: str = Depends(require_auth),
+    repository: FirestoreRepository = Depends(repository_dependency),
     title: str = Form(...),
     content: str = Form(""),
     csrf_token: str = Form(...)
 ):
     """Create a new note"""
-    # Basic CSRF validation
-    if not csrf_token or len(csrf_token) < 32:
+    # CSRF validation against the token bound to this browser
+    if not check_csrf_token(request, csrf_token):
         raise HTTPException(status_code=400, detail="Invalid CSRF token")
     
-    repository = get_repository()
-    
     try:
         # Decrypt incoming encrypted data
         try:
-            decrypted_title = decrypt_data(title)
-            decrypted_content = decrypt_data(content)
+            decrypted_title, decrypted_content = decrypt_many([title, content])
         except EncryptionError as e:
             raise HTTPException(status_code=400, detail=f"Decryption error: {str(e)}")
         
-        note_data = NoteCreate(title=decrypted_title, content=decrypted_content)
+        note_data = _NOTE_CREATE.validate_python({'title': decrypted_title, 'content': decrypted_content})
         note = await repository.create_note(note_data)
         
         # Encrypt note data for template
-        try:
-            note_dict = note.dict()
-            note_dict['title'] = encrypt_data(note_dict['title'])
-            note_dict['content'] = encrypt_data(note_dict['content'])
-        except EncryptionError as e:
-            raise HTTPException(status_code=500, detail=f"Encryption error: {str(e)}")
+        note_view = _encrypt_note(note, settings.encrypt_html)
         
-        return templates.TemplateResponse("note_editor.html", {
+        return render_template("note_editor.html", {
             "request": request,
             "title": "Edit Note",
-            "note": note_dict,
-            "csrf_token": generate_csrf_token(),
+            "note": note_view,
+            "csrf_token": get_csrf_token(request),
             "is_editing": True,
             "message": "Note created successfully!"
         })
     except ValueError as e:
-        return templates.TemplateResponse("note_editor.html", {
+        # Re-show what was submitted: the client's ciphertext, or the plain values
+        if settings.encrypt_html:
+            submitted = {"title": title, "content": content}
+        else:
+            submitted = {"title": decrypted_title, "content": decrypted_content}
+        return render_template("note_editor.html", {
             "request": request,
             "title": "Create New Note",
-            "note": {"title": title, "content": content},
-            "csrf_token": generate_csrf_token(),
+            "note": submitted,
+            "csrf_token": get_csrf_token(request),
             "is_editing": False,
             "error": str(e)
         }, status_code=400)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error creating note: {str(e)}")
 
 
 @router.get("/notes/{note_id}", response_class=HTMLResponse)
 async def get_note_editor(
     request: Request,
     note_id: str,
-    current_user: str = Depends(require_auth)
+    current_user: str = Depends(require_auth),
+    repository: FirestoreRepository = Depends(repository_dependency)
 ):
     """Display note editor"""
-    repository = get_repository()
+    note = await repository.get_note(note_id)
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found")
     
-    try:
-        note = await repository.get_note(note_id)
-        if not note:
-            raise HTTPException(status_code=404, detail="Note not found")
-        
-        csrf_token = generate_csrf_token()
-        
-        # Encrypt note data for template
-        try:
-            note_dict = note.dict()
-            note_dict['title'] = encrypt_data(note_dict['title'])
-            note_dict['content'] = encrypt_data(note_dict['content'])
-        except EncryptionError as e:
-            raise HTTPException(status_code=500, detail=f"Encryption error: {str(e)}")
-        
-        return templates.TemplateResponse("note_editor.html", {
-            "request": request,
-            "title": f"Edit: {note.title}",
-            "note": note_dict,
-            "csrf_token": csrf_token,
-            "is_editing": True
-        })
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error loading note: {str(e)}")
+    csrf_token = get_csrf_token(request)
+    
+    # Encrypt note data for template
+    note_view = _encrypt_note(note, settings.encrypt_html)
+    
+    response = render_template("note_editor.html", {
+        "request": request,
+        "title": f"Edit: {note.title}",
+        "note": note_view,
+        "csrf_token": csrf_token,
+        "is_editing": True
+    })
+    return attach_csrf_cookie(request, response)
 
 
 @router.post("/notes/{note_id}")
@@ -172,298 +274,290 @@ async def update_note(
     request: Request,
     note_id: str,
     current_user: str = Depends(require_auth),
+    repository: FirestoreRepository = Depends(repository_dependency),
     title: str = Form(...),
     content: str = Form(""),
     csrf_token: str = Form(...)
 ):
     """Update an existing note"""
-    # Basic CSRF validation
-    if not csrf_token or len(csrf_token) < 32:
+    # CSRF validation against the token bound to this browser
+    if not check_csrf_token(request, csrf_token):
         raise HTTPException(status_code=400, detail="Invalid CSRF token")
     
-    repository = get_repository()
-    
     try:
         # Decrypt incoming encrypted data
         try:
-            decrypted_title = decrypt_data(title)
-            decrypted_content = decrypt_data(content)
+            decrypted_title, decrypted_content = decrypt_many([title, content])
         except EncryptionError as e:
             raise HTTPException(status_code=400, detail=f"Decryption error: {str(e)}")
         
-        note_update = NoteUpdate(title=decrypted_title, content=decrypted_content)
+        note_update = _NOTE_UPDATE.validate_python({'title': decrypted_title, 'content': decrypted_content})
         note = await repository.update_note(note_id, note_update)
         
         if not note:
             raise HTTPException(status_code=404, detail="Note not found")
         
         # Encrypt note data for template
-        try:
-            note_dict = note.dict()
-            note_dict['title'] = encrypt_data(note_dict['title'])
-            note_dict['content'] = encrypt_data(note_dict['content'])
-        except EncryptionError as e:
-            raise HTTPException(status_code=500, detail=f"Encryption error: {str(e)}")
+        note_view = _encrypt_note(note, settings.encrypt_html)
         
-        return templates.TemplateResponse("note_editor.html", {
+        return render_template("note_editor.html", {
             "request": request,
             "title": f"Edit: {note.title}",
-            "note": note_dict,
-            "csrf_token": generate_csrf_token(),
+            "note": note_view,
+            "csrf_token": get_csrf_token(request),
             "is_editing": True,
             "message": "Note updated successfully!"
         })
     except ValueError as e:
-        # Return current note data on validation error
-        note = await repository.get_note(note_id)
-        return templates.TemplateResponse("note_editor.html", {
+        # Re-show what was submitted: the client's ciphertext, or the plain values
+        if settings.encrypt_html:
+            submitted = {"id": note_id, "title": title, "content": content}
+        else:
+            submitted = {"id": note_id, "title": decrypted_title, "content": decrypted_content}
+        return render_template("note_editor.html", {
             "request": request,
             "title": f"Edit: {title}",
-            "note": {"id": note_id, "title": title, "content": content} if not note else note,
-            "csrf_token": generate_csrf_token(),
+            "note": submitted,
+            "csrf_token": get_csrf_token(request),
             "is_editing": True,
             "error": str(e)
         }, status_code=400)
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error updating note: {str(e)}")
 
 
 @router.delete("/notes/{note_id}")
 async def delete_note(
     note_id: str,
-    current_user: str = Depends(require_auth)
+    current_user: str = Depends(require_auth),
+    repository: FirestoreRepository = Depends(repository_dependency)
 ):
     """Delete a note"""
-    repository = get_repository()
+    success = await repository.delete_note(note_id)
+    if not success:
+        raise HTTPException(status_code=404, detail="Note not found")
     
-    try:
-        success = await repository.delete_note(note_id)
-        if not success:
-            raise HTTPException(status_code=404, detail="Note not found")
-        
-        return {"message": "Note deleted successfully"}
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error deleting note: {str(e)}")
+    return {"message": "Note deleted successfully"}
 
 
 @router.get("/notes/{note_id}/preview", response_class=HTMLResponse)
 async def preview_note(
     request: Request,
     note_id: str,
-    current_user: str = Depends(require_auth)
+    current_user: str = Depends(require_auth),
+    repository: FirestoreRepository = Depends(repository_dependency),
+    client_render: bool = Query(False, description="Send the markdown source for the browser to render")
 ):
     """Display note preview with rendered markdown"""
-    repository = get_repository()
+    note = await repository.get_note(note_id)
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found")
     
-    try:
-        note = await repository.get_note(note_id)
-        if not note:
-            raise HTTPException(status_code=404, detail="Note not found")
-        
-        # Convert markdown to HTML
-        md = markdown.Markdown(extensions=['extra', 'codehilite'])
-        html_content = md.convert(note.content)
-        
-        # Encrypt data for template
-        try:
-            note_dict = note.dict()
-            note_dict['title'] = encrypt_data(note_dict['title'])
-            note_dict['content'] = encrypt_data(note_dict['content'])
-            encrypted_html = encrypt_data(html_content)
-        except EncryptionError as e:
-            raise HTTPException(status_code=500, detail=f"Encryption error: {str(e)}")
-        
-        return templates.TemplateResponse("note_preview.html", {
-            "request": request,
-            "title": f"Preview: {note.title}",
-            "note": note_dict,
-            "html_content": encrypted_html
-        })
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error previewing note: {str(e)}")
+    # Skip rendering and encryption when the client's copy is current
+    etag = _preview_etag(note)
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    
+    if await request.is_disconnected():
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    
+    # Convert markdown to HTML, unless the browser will render the source itself
+    if client_render:
+        body = note.content
+    else:
+        body = await render_markdown_async(note.content, key=(note.id, note.updated_at))
+    
+    # Encrypt data for template; the page shows the title and either the rendered HTML or the source
+    if settings.encrypt_html:
+        encrypted_title, encrypted_body = encrypt_many([note.title, body])
+    else:
+        encrypted_title, encrypted_body = note.title, body
+    note_dict = {
+        'id': note.id,
+        'title': encrypted_title,
+        'created_at': note.created_at,
+        'updated_at': note.updated_at,
+    }
+    
+    response = render_template("note_preview.html", {
+        "request": request,
+        "title": f"Preview: {note.title}",
+        "note": note_dict,
+        "client_render": client_render,
+        "markdown_source": encrypted_body if client_render else None,
+        "html_content": None if client_render else encrypted_body
+    })
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = PREVIEW_CACHE_CONTROL
+    return response
 
 
 # API endpoints for AJAX requests
-@router.get("/api/notes", response_model=List[NoteSummary])
+# response_model only documents the shape; the route returns its own response
+@router.get("/api/notes", response_class=ORJSONResponse, response_model=List[NoteSummary])
 async def api_get_notes(
+    request: Request,
     current_user: str = Depends(require_auth),
+    repository: FirestoreRepository = Depends(repository_dependency),
     search: Optional[str] = Query(None),
     limit: int = Query(20, ge=1, le=100),
-    offset: int = Query(0, ge=0)
+    offset: int = Query(0, ge=0),
+    after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor header")
 ):
     """API endpoint to get notes list"""
-    repository = get_repository()
+    headers = {}
+    if search:
+        notes = await repository.search_notes(search, limit)
+    else:
+        try:
+            notes = await repository.get_notes(limit, offset, start_after=after)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if len(notes) == limit:
+            headers["X-Next-Cursor"] = note_cursor(notes[-1])
     
-    try:
-        if search:
-            notes = await repository.search_notes(search, limit)
-        else:
-            notes = await repository.get_notes(limit, offset)
-        
-        # Encrypt summaries for API response
-        encrypted_summaries = []
-        for note in notes:
-            summary = create_note_summary(note)
-            try:
-                summary_dict = summary.dict()
-                summary_dict['title'] = encrypt_data(summary_dict['title'])
-                summary_dict['content_preview'] = encrypt_data(summary_dict['content_preview'])
-                encrypted_summaries.append(summary_dict)
-            except EncryptionError as e:
-                raise HTTPException(status_code=500, detail=f"Encryption error: {str(e)}")
-        return encrypted_summaries
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error loading notes: {str(e)}")
-
-
-@router.get("/api/notes/{note_id}/preview")
+    if await request.is_disconnected():
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    
+    # Encrypt summaries for API response; returned directly so FastAPI skips
+    # response_model validation and jsonable_encoder
+    encrypted_summaries = await asyncio.to_thread(_encrypt_summaries, notes)
+    return ORJSONResponse(encrypted_summaries, headers=headers)
+
+
+@router.get("/api/notes/{note_id}/preview", response_class=ORJSONResponse)
 async def api_preview_note(
+    request: Request,
     note_id: str,
-    current_user: str = Depends(require_auth)
+    current_user: str = Depends(require_auth),
+    repository: FirestoreRepository = Depends(repository_dependency),
+    client_render: bool = Query(False, description="Return the encrypted markdown source instead of HTML")
 ):
-    """API endpoint to get markdown rendered as HTML"""
-    repository = get_repository()
+    """API endpoint to get markdown rendered as HTML, or its source for clients that render it"""
+    note = await repository.get_note(note_id)
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found")
     
-    try:
-        note = await repository.get_note(note_id)
-        if not note:
-            raise HTTPException(status_code=404, detail="Note not found")
-        
-        # Convert markdown to HTML and encrypt
-        md = markdown.Markdown(extensions=['extra', 'codehilite'])
-        html_content = md.convert(note.content)
-        
-        try:
-            encrypted_html = encrypt_data(html_content)
-        except EncryptionError as e:
-            raise HTTPException(status_code=500, detail=f"Encryption error: {str(e)}")
-        
-        return {"html": encrypted_html}
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error previewing note: {str(e)}")
+    etag = _preview_etag(note)
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    
+    if await request.is_disconnected():
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    
+    headers = {"ETag": etag, "Cache-Control": PREVIEW_CACHE_CONTROL}
+    if client_render:
+        return ORJSONResponse({"content": encrypt_data(note.content)}, headers=headers)
+    
+    # Convert markdown to HTML and encrypt
+    html_content = await render_markdown_async(note.content, key=(note.id, note.updated_at))
+    
+    encrypted_html = encrypt_data(html_content)
+    
+    return ORJSONResponse({"html": encrypted_html}, headers=headers)
 
 
-@router.get("/api/notes/{note_id}")
+@router.get("/api/notes/batch", response_class=ORJSONResponse)
+async def api_get_notes_batch(
+    current_user: str = Depends(require_auth),
+    repository: FirestoreRepository = Depends(repository_dependency),
+    ids: List[str] = Query(..., description="Note IDs to fetch; repeat the parameter for each ID")
+):
+    """API endpoint to get several notes with encrypted fields in one request"""
+    if len(ids) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} notes can be fetched at once")
+    if not all(_is_valid_note_id(note_id) for note_id in ids):
+        raise HTTPException(status_code=400, detail="Invalid note ID")
+    
+    notes = await repository.get_notes_by_ids(ids)
+    
+    # One encryption batch for the whole response
+    return ORJSONResponse(_encrypt_notes(notes))
+
+
+@router.get("/api/notes/{note_id}", response_class=ORJSONResponse)
 async def api_get_note(
     note_id: str,
-    current_user: str = Depends(require_auth)
+    current_user: str = Depends(require_auth),
+    repository: FirestoreRepository = Depends(repository_dependency)
 ):
     """API endpoint to get a single note with encrypted fields."""
-    repository = get_repository()
-
-    try:
-        note = await repository.get_note(note_id)
-        if not note:
-            raise HTTPException(status_code=404, detail="Note not found")
-
-        # Prepare response with ISO datetimes and encrypted strings
-        note_dict = note.dict()
-        if note_dict.get('created_at'):
-            note_dict['created_at'] = note_dict['created_at'].isoformat()
-        if note_dict.get('updated_at'):
-            note_dict['updated_at'] = note_dict['updated_at'].isoformat()
-
-        try:
-            note_dict['title'] = encrypt_data(note.title)
-            note_dict['content'] = encrypt_data(note.content)
-        except EncryptionError as e:
-            raise HTTPException(status_code=500, detail=f"Encryption error: {str(e)}")
+    note = await repository.get_note(note_id)
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found")
 
-        return note_dict
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error loading note: {str(e)}")
+    # Returned as a response object so it skips FastAPI's jsonable_encoder;
+    # orjson serializes the dataclass and writes the datetimes as ISO strings
+    return ORJSONResponse(_encrypt_note(note))
 
 @router.post("/upload")
 async def upload_file(
     request: Request,
     current_user: str = Depends(require_auth),
+    repository: FirestoreRepository = Depends(repository_dependency),
     file: UploadFile = File(...),
-    csrf_token: str = Form(...)
+    csrf_token: str = Form(...),
+    x_encrypted: Optional[str] = Header(None, description="1 when the client encrypted the file content")
 ):
     """Upload a text file and create a note from its content"""
-    print(f"Upload attempt - filename: {file.filename}, content_type: {file.content_type}, csrf_token length: {len(csrf_token) if csrf_token else 0}")
+    logger.debug(
+        "Upload attempt - filename: %s, content_type: %s, csrf_token length: %d",
+        file.filename, file.content_type, len(csrf_token) if csrf_token else 0
+    )
     
-    # Basic CSRF validation
-    if not csrf_token or len(csrf_token) < 32:
+    # CSRF validation against the token bound to this browser
+    if not check_csrf_token(request, csrf_token):
         raise HTTPException(status_code=400, detail="Invalid CSRF token")
     
-    # Validate file type
-    allowed_extensions = {'.txt', '.md'}
-    file_ext = os.path.splitext(file.filename)[1].lower() if file.filename else ''
-    if file_ext not in allowed_extensions:
+    # Validate file type; the name without its extension becomes the title
+    filename_base, file_ext = os.path.splitext(file.filename or "Uploaded File")
+    if file_ext.lower() not in _ALLOWED_EXT:
         raise HTTPException(status_code=400, detail="Only .txt and .md files are allowed")
     
     # Check file size (1MB limit)
     MAX_FILE_SIZE = 1024 * 1024  # 1MB in bytes
     
+    # Read and decode in chunks so oversized uploads are rejected without buffering them
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    parts = []
+    size = 0
     try:
-        # Read file content
-        content = await file.read()
-        
-        if len(content) > MAX_FILE_SIZE:
-            raise HTTPException(status_code=400, detail="File size exceeds 1MB limit")
-        
-        # Decode content as UTF-8
-        try:
-            file_content = content.decode('utf-8')
-        except UnicodeDecodeError:
-            raise HTTPException(status_code=400, detail="File must be valid UTF-8 text")
-        
-        # Extract filename without extension for title
-        filename_base = os.path.splitext(file.filename)[0] if file.filename else "Uploaded File"
-        
-        # For file uploads, we only encrypt the content, not the filename
-        # The filename comes from the original file and is used as-is for the title
-        decrypted_title = filename_base
-        
-        # Decrypt file content (client encrypts before upload)
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > MAX_FILE_SIZE:
+                raise HTTPException(status_code=400, detail="File size exceeds 1MB limit")
+            parts.append(decoder.decode(chunk))
+        parts.append(decoder.decode(b'', final=True))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="File must be valid UTF-8 text")
+    file_content = ''.join(parts)
+    
+    # For file uploads, we only encrypt the content, not the filename
+    # The filename comes from the original file and is used as-is for the title
+    decrypted_title = filename_base
+    
+    # Decrypt file content only when the client says it encrypted it
+    if x_encrypted == "1":
         try:
             decrypted_content = decrypt_data(file_content)
-        except EncryptionError:
-            # If decryption fails, assume data is not encrypted (fallback)
-            decrypted_content = file_content
-        
-        # Create note
-        repository = get_repository()
-        note_data = NoteCreate(title=decrypted_title, content=decrypted_content)
-        note = await repository.create_note(note_data)
-        
-        # Encrypt note data for response
-        try:
-            # Convert to dict with proper datetime serialization
-            note_dict = note.dict()
-            # Convert datetimes to ISO format strings
-            if note_dict.get('created_at'):
-                note_dict['created_at'] = note_dict['created_at'].isoformat()
-            if note_dict.get('updated_at'):
-                note_dict['updated_at'] = note_dict['updated_at'].isoformat()
-            
-            note_dict['title'] = encrypt_data(note_dict['title'])
-            note_dict['content'] = encrypt_data(note_dict['content'])
         except EncryptionError as e:
-            raise HTTPException(status_code=500, detail=f"Encryption error: {str(e)}")
-        
-        return JSONResponse({
-            "success": True,
-            "message": "File uploaded successfully",
-            "note": note_dict,
-            "note_id": note.id
-        })
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
+            raise HTTPException(status_code=400, detail=f"Decryption error: {str(e)}")
+    else:
+        decrypted_content = file_content
+    
+    # Create note
+    note_data = _NOTE_CREATE.validate_python({'title': decrypted_title, 'content': decrypted_content})
+    note = await repository.create_note(note_data)
+    
+    # Encrypt note data for response; orjson serializes the view and its datetimes
+    note_view = _encrypt_note(note)
+    
+    return ORJSONResponse({
+        "success": True,
+        "message": "File uploaded successfully",
+        "note": note_view,
+        "note_id": note.id
+    })
 
 
 @router.get("/upload", response_class=HTMLResponse)
@@ -472,12 +566,13 @@ async def upload_page(
     current_user: str = Depends(require_auth)
 ):
     """Display file upload page"""
-    csrf_token = generate_csrf_token()
+    csrf_token = get_csrf_token(request)
     
-    return templates.TemplateResponse("upload.html", {
+    response = render_template("upload.html", {
         "request": request,
         "title": "Upload File",
         "csrf_token": csrf_token
     })
+    return attach_csrf_cookie(request, response)
 
 
@@ -10,6 +10,9 @@ let AES_KEY_BYTES = null;
 
 let cryptoKey = null;
 
+// Set by base.html; when false the server relies on TLS and values pass through as-is
+const ENCRYPT_IN_TRANSIT = window.ENCRYPT_IN_TRANSIT !== false;
+
 /**
  * Derive AES key from user input using SHA-256
  */
@@ -184,6 +187,10 @@ async function encryptData(plaintext) {
         return '';
     }
     
+    if (!ENCRYPT_IN_TRANSIT) {
+        return plaintext;
+    }
+    
     try {
         await initializeCrypto();
         
@@ -220,6 +227,10 @@ async function decryptData(encryptedData) {
         return '';
     }
     
+    if (!ENCRYPT_IN_TRANSIT) {
+        return encryptedData;
+    }
+    
     try {
         await initializeCrypto();
         
@@ -119,6 +119,8 @@ document.addEventListener('DOMContentLoaded', function() {
 
         const response = await fetch('/upload', {
             method: 'POST',
+            // Tells the server to decrypt the content; unencrypted uploads omit it
+            headers: { 'X-Encrypted': '1' },
             body: formData
         });
 
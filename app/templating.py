@@ -0,0 +1,43 @@
+from typing import Dict
+
+from fastapi.responses import HTMLResponse
+from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache, Template
+
+from app.config import settings
+
+# Shared by every router so there is one Environment and one template cache.
+# Templates only change on deploy: skip the per-render mtime check in
+# production and keep compiled template bytecode in the temp directory.
+templates = Jinja2Templates(directory="app/templates")
+templates.env.auto_reload = not settings.is_production
+templates.env.bytecode_cache = FileSystemBytecodeCache()
+
+# Whether HTML pages carry ciphertext for the browser to decrypt or plain values
+templates.env.globals["encrypt_html"] = settings.encrypt_html
+# Whether the browser encrypts form values and decrypts API responses at all
+templates.env.globals["encrypt_in_transit"] = settings.encrypt_in_transit
+
+# Compiled templates by name, used when auto_reload is off
+_compiled: Dict[str, Template] = {}
+
+
+def get_template(name: str) -> Template:
+    """Return the compiled template, going through Jinja's loader only when reloading is on"""
+    if templates.env.auto_reload:
+        return templates.env.get_template(name)
+    template = _compiled.get(name)
+    if template is None:
+        template = _compiled[name] = templates.env.get_template(name)
+    return template
+
+
+def render_template(name: str, context: dict, status_code: int = 200) -> HTMLResponse:
+    """Render a template straight to an HTMLResponse"""
+    return HTMLResponse(get_template(name).render(context), status_code=status_code)
+
+
+def warm_templates() -> None:
+    """Compile every template up front so the first requests don't pay for it"""
+    for name in templates.env.list_templates():
+        get_template(name)
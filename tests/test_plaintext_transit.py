@@ -0,0 +1,97 @@
+"""
+ENCRYPT_IN_TRANSIT=false end to end: the crypto helpers pass values through,
+ENCRYPT_HTML is forced off, and pages, API responses and uploads carry plain
+text. Settings are read at import, so this module sets the environment before
+importing the app and should run in its own pytest process.
+
+Run with: python -m pytest tests
+"""
+import os
+import re
+from datetime import datetime, timezone
+
+os.environ["ENCRYPT_IN_TRANSIT"] = "false"
+os.environ.setdefault("AES_KEY", "test-key")
+
+from fastapi.testclient import TestClient
+
+from app.auth.auth import create_access_token
+from app.config import settings
+from app.crypto import encryption
+from app.main import app
+from app.models.notes import Note
+from app.repositories.firestore import repository_dependency
+
+
+class InMemoryRepository:
+    """Just enough of FirestoreRepository for the routes exercised here"""
+
+    def __init__(self):
+        self.notes = {}
+
+    async def create_note(self, note_data):
+        now = datetime.now(timezone.utc)
+        note = Note(id=f"n{len(self.notes) + 1}", title=note_data.title, content=note_data.content,
+                    created_at=now, updated_at=now)
+        self.notes[note.id] = note
+        return note
+
+    async def get_note(self, note_id):
+        return self.notes.get(note_id)
+
+    async def get_notes(self, limit=50, offset=0, start_after=None):
+        return list(self.notes.values())[:limit]
+
+
+repository = InMemoryRepository()
+app.dependency_overrides[repository_dependency] = lambda: repository
+
+# No lifespan: it would try to connect to Firestore
+client = TestClient(app)
+client.cookies.set("session_token", create_access_token(settings.username))
+
+
+def _csrf_token(html: str) -> str:
+    return re.search(r'name="csrf_token" value="([^"]+)"', html).group(1)
+
+
+def test_flags_and_passthrough():
+    assert settings.encrypt_in_transit is False
+    assert settings.encrypt_html is False
+    assert encryption.encrypt_data("secret") == "secret"
+    assert encryption.decrypt_data("secret") == "secret"
+    assert encryption.encrypt_many(["a", b"b", ""]) == ["a", "b", ""]
+    assert encryption.decrypt_many(["a", ""]) == ["a", ""]
+
+
+def test_pages_and_api_are_plaintext():
+    form = client.get("/notes/new")
+    assert "window.ENCRYPT_IN_TRANSIT = false;" in form.text
+
+    response = client.post("/notes", data={
+        "title": "Plain title",
+        "content": "# Plain body",
+        "csrf_token": _csrf_token(form.text),
+    })
+    assert response.status_code == 200
+    assert 'value="Plain title"' in response.text
+    assert "window.noteData" not in response.text
+    note_id = re.search(r'action="/notes/([^"]+)"', response.text).group(1)
+
+    assert "Plain title" in client.get("/notes").text
+    assert "<h1>Plain body</h1>" in client.get(f"/notes/{note_id}/preview").text
+
+    note = client.get(f"/api/notes/{note_id}").json()
+    assert (note["title"], note["content"]) == ("Plain title", "# Plain body")
+
+
+def test_upload_is_plaintext():
+    token = _csrf_token(client.get("/upload").text)
+    response = client.post(
+        "/upload",
+        data={"csrf_token": token},
+        files={"file": ("plain.md", b"uploaded *text*", "text/markdown")},
+        headers={"X-Encrypted": "1"},
+    )
+    assert response.status_code == 200
+    assert response.json()["note"]["content"] == "uploaded *text*"